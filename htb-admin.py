@@ -1,13 +1,29 @@
 """Module for utilizing the HackTheBox API for machine management"""
-import json
+import argparse
+import fcntl
 import os
+import socket
+import struct
 import sys
 import time
-from copy import deepcopy
+from pathlib import Path
 
-import tabulate
-from hackthebox import HTBClient
-import netifaces as ni
+SIOCGIFADDR = 0x8915
+
+VALID_DIFFICULTIES = frozenset(range(10, 101, 10))
+
+DIFFICULTY_KEYS = (
+    ("Cake", "counterCake"),
+    ("VeryEasy", "counterVeryEasy"),
+    ("Easy", "counterEasy"),
+    ("TooEasy", "counterTooEasy"),
+    ("Medium", "counterMedium"),
+    ("BitHard", "counterBitHard"),
+    ("Hard", "counterHard"),
+    ("TooHard", "counterTooHard"),
+    ("ExHard", "counterExHard"),
+    ("BrainFuck", "counterBrainFuck")
+)
 
 
 class MultipleMachinesFound(Exception):
@@ -24,23 +40,92 @@ class MultipleMachinesFound(Exception):
             yield machine.name
 
 
+class TokenNotFound(Exception):
+
+    def __init__(self, token_path=None):
+        self.token_path = token_path
+
+    def __str__(self):
+        if self.token_path is None:
+            return "Could not find HackTheBox API token"
+        return f"Could not find HackTheBox API token: {self.token_path}"
+
+
+class Command(argparse.Action):
+    """Stores an option value and records the handler that runs its command"""
+
+    def __init__(self, option_strings, dest, handler, **kwargs):
+        super().__init__(option_strings, dest, **kwargs)
+        self.handler = handler
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        setattr(namespace, self.dest, True if self.nargs == 0 else values)
+        namespace.handler = self.handler
+
+
 class Client:
     """HackTheBox API Client"""
 
+    machines_ttl = 300
+    active_ttl = 2
+
     def __init__(self, token_path):
+        from hackthebox import HTBClient, htb
+
+        # The SDK calls requests.get/post directly, so route them through one session
+        htb.requests = self.get_session()
         token = self.get_token(token_path)
         self.client = HTBClient(app_token=token)
+        self._machines_cache = {}
+        self._active_cache = None
+
+    def _get_catalog(self, retired):
+        """Gets the cached machine list along with its lowercased names"""
+
+        cached = self._machines_cache.get(retired)
+        if cached is not None:
+            timestamp, machines, names = cached
+            if time.monotonic() - timestamp < self.machines_ttl:
+                return machines, names
+
+        machines = list(self.client.get_machines(retired=retired))
+        names = [machine.name.lower() for machine in machines]
+        self._machines_cache[retired] = (time.monotonic(), machines, names)
+        return machines, names
+
+    def prefetch(self, retired=True):
+        """Concurrently fetches the machine list and the active machine"""
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            catalog = executor.submit(self._get_catalog, retired)
+            active = executor.submit(self._active)
+            catalog.result()
+            try:
+                return active.result()
+            except StopIteration:
+                return None
 
     def search(self, query, retired=True):
         """Alternatively searches HackTheBox API for machine given a search query"""
 
-        machines = []
-        _machines = self.client.get_machines(retired=retired)
-        for machine in _machines:
-            if query.lower() in machine.name.lower():
-                machines.append(machine)
+        query = query.lower()
+        machines, names = self._get_catalog(retired)
+        return [machine for machine, name in zip(machines, names) if query in name]
 
-        return machines
+    def _active(self):
+        """Gets the active machine, reusing a very recent lookup when available"""
+
+        cached = self._active_cache
+        if cached is not None:
+            timestamp, machine = cached
+            if time.monotonic() - timestamp < self.active_ttl:
+                return machine
+
+        machine = self.client.get_active_machine()
+        self._active_cache = (time.monotonic(), machine)
+        return machine
 
     def start(self, machine):
         """Starts an instance of the machine given a machine name"""
@@ -50,17 +135,18 @@ class Client:
         except KeyError:
             pass
         except Exception as error:
-            if "You must stop your active machine" in str(error):
+            message = error.args[0] if error.args else ""
+            if isinstance(message, str) and "You must stop your active machine" in message:
                 return 1
-            else:
-                raise error
-        
+            raise
+
+        self._active_cache = None
         return 0
 
     def description(self):
         """Gets currently active machine description"""
 
-        return self.client.get_active_machine()
+        return self._active()
 
     def stop(self):
         """Stops the currently active machine"""
@@ -69,6 +155,7 @@ class Client:
         if machine is not None:
             machine_name = machine.machine.name
             machine.stop()
+            self._active_cache = None
             return machine_name
 
     def reset(self):
@@ -81,6 +168,7 @@ class Client:
                 machine.reset()
             except KeyError:
                 pass
+            self._active_cache = None
 
             return machine_name
 
@@ -89,14 +177,16 @@ class Client:
 
         machine = self.client.get_active_machine()
         if machine:
-            machine_name = machine.machine.name
-            message = machine.machine.submit(flag, difficulty)
+            details = machine.machine
+            machine_name = details.name
+            message = details.submit(flag, difficulty)
+            self._active_cache = None
             return machine_name, message
 
     def target(self):
         """Gets the currently active machine"s IP address"""
 
-        machine = self.client.get_active_machine()
+        machine = self._active()
         if machine:
             return machine.ip
 
@@ -104,13 +194,31 @@ class Client:
     def get_local_ip():
         """Gets the local IP address of the tun0 adapter"""
 
-        try:
-            address = ni.ifaddresses("tun0")[ni.AF_INET][0]["addr"]
-        except ValueError:
-            address = None
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            request = struct.pack("256s", b"tun0")
+            try:
+                response = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, request)
+            except OSError:
+                address = None
+            else:
+                address = socket.inet_ntoa(response[20:24])
 
         return address
 
+    @staticmethod
+    def get_session():
+        """Gets a requests session that keeps HackTheBox API connections alive"""
+
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        session = requests.Session()
+        retries = Retry(total=2, backoff_factor=0.2)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retries)
+        session.mount("https://", adapter)
+        return session
+
     @staticmethod
     def get_token(token_path=None):
         """Gets the HackTheBox API token"""
@@ -118,15 +226,38 @@ class Client:
         if token_path is None:
             token = os.environ.get("HTB_TOKEN", None)
             if token is None:
-                error = "[-] Could not find HackTheBox API token"
-                raise Exception(error)
+                raise TokenNotFound()
         else:
-            with open(token_path, "r") as file:
-                token = file.read().strip()
+            try:
+                token = Path(token_path).read_text().strip()
+            except FileNotFoundError:
+                raise TokenNotFound(token_path) from None
 
         return token
 
 
+def _json_default(value):
+    """Converts values the JSON encoders can not handle natively"""
+
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def dumps(json_dict):
+    """Serializes a dictionary to indented JSON, using orjson when available"""
+
+    try:
+        import orjson
+    except ImportError:
+        import json
+
+        return json.dumps(json_dict, indent=2, default=_json_default)
+
+    option = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+    return orjson.dumps(json_dict, default=str, option=option).decode()
+
+
 def get_machine_server_json(machine_server):
     json_dict = {
         "id": machine_server.id,
@@ -138,18 +269,7 @@ def get_machine_server_json(machine_server):
 
 
 def get_difficulty_json(difficulty):
-    json_dict = {
-        "Cake": difficulty["counterCake"],
-        "VeryEasy": difficulty["counterVeryEasy"],
-        "Easy": difficulty["counterEasy"],
-        "TooEasy": difficulty["counterTooEasy"],
-        "Medium": difficulty["counterMedium"],
-        "BitHard": difficulty["counterBitHard"],
-        "Hard": difficulty["counterHard"],
-        "TooHard": difficulty["counterTooHard"],
-        "ExHard": difficulty["counterExHard"],
-        "BrainFuck": difficulty["counterBrainFuck"]
-    }
+    json_dict = {key: difficulty[counter] for key, counter in DIFFICULTY_KEYS}
     return json_dict
 
 
@@ -157,7 +277,7 @@ def get_machine_blood_json(machine_blood):
     json_dict = {
         "id": machine_blood.id,
         "blood": machine_blood.blood,
-        "date": str(machine_blood.date),
+        "date": machine_blood.date,
         "name": machine_blood.name,
         "type": machine_blood.type
     }
@@ -170,7 +290,7 @@ def get_machine_machine_json(machine_machine):
         "name": machine_machine.name,
         "os": machine_machine.os,
         "points": machine_machine.points,
-        "release_date": str(machine_machine.release_date),
+        "release_date": machine_machine.release_date,
         "user_owns": machine_machine.user_owns,
         "root_owns": machine_machine.root_owns,
         "user_owned": machine_machine.user_owned,
@@ -183,11 +303,11 @@ def get_machine_machine_json(machine_machine):
         "author_ids": machine_machine._author_ids,
         "active": machine_machine.active,
         "retired": machine_machine.retired,
-        "user_own_time": str(machine_machine.user_own_time),
-        "root_own_time": str(machine_machine.root_own_time),
+        "user_own_time": machine_machine.user_own_time,
+        "root_own_time": machine_machine.root_own_time,
         "difficulty_ratings": get_difficulty_json(machine_machine.difficulty_ratings),
-        "user_blood": get_machine_blood_json(machine.machine.user_blood),
-        "root_blood": get_machine_blood_json(machine.machine.root_blood)
+        "user_blood": get_machine_blood_json(machine_machine.user_blood),
+        "root_blood": get_machine_blood_json(machine_machine.root_blood)
     }
     return json_dict
 
@@ -198,311 +318,270 @@ def get_machine_json(machine):
         "server": get_machine_server_json(machine.server),
         "machine": get_machine_machine_json(machine.machine)
     }
-    print(json.dumps(json_dict, indent=2))
+    return json_dict
 
 
-def main(args):
-    if os.getuid() != 0:
-        print("[!] Must be run as an administrator")
-        sys.exit(1)
+def _flag_type(value):
+    """Parses a <flag>:<difficulty> argument into the flag and its difficulty"""
+
+    flag, separator, difficulty = value.partition(":")
+    if not separator:
+        error = f"Invalid flag format: {value}, correct format is <flag>:<difficulty>"
+        raise argparse.ArgumentTypeError(error)
+
+    try:
+        difficulty = int(difficulty)
+    except ValueError:
+        error = "Invalid difficulty argument, must be an integer"
+        raise argparse.ArgumentTypeError(error)
+
+    if difficulty not in VALID_DIFFICULTIES:
+        error = "Difficulty must be a multiple of 10 between 10 and 100"
+        raise argparse.ArgumentTypeError(error)
+
+    return flag, difficulty
+
+
+def _get_target(client):
+    """Gets the active machine IP address, treating a busy machine as not ready"""
+
+    try:
+        return client.target()
+    except StopIteration:
+        return None
+
+
+def _wait_for(predicate, timeout, initial=0.25, factor=2.0, cap=5.0):
+    """Polls the predicate with exponential backoff until truthy or timed out"""
+
+    deadline = time.monotonic() + timeout
+    delay = initial
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        time.sleep(min(delay, remaining))
+        result = predicate()
+        if result:
+            return result
+        delay = min(delay * factor, cap)
+
 
-    client = Client(args.token_path)
-    if args.query:
-        if args.id:
-            machine = client.client.get_machine(args.id)
-            output = [
-                ["Difficulty", machine.difficulty],
-                ["Name", machine.name],
-                ["ID", machine.id]
-            ]
-            print(tabulate.tabulate(output, tablefmt="psql"))
+def _wait_for_address(client, timeout=300):
+    """Waits for the active machine IP address, returning it with the elapsed time"""
+
+    start_time = time.monotonic()
+    address = _wait_for(lambda: _get_target(client), timeout)
+    end_time = time.monotonic()
+    elapsed = round(end_time - start_time, 2)
+    return address, elapsed
+
+
+def _start_and_wait(client, machine, active=None):
+    """Starts the machine and waits for its IP address to become available"""
+
+    if active is not None:
+        print("There is a machine that is already active")
+        return
+
+    result = client.start(machine)
+    if result == 0:
+        print("\n".join([
+            f"Started instance: {machine.name}",
+            "The machine takes time to start up completely",
+            "Please wait..."
+        ]), flush=True)
+        address, elapsed = _wait_for_address(client)
+        if address is not None:
+            print("\n".join([
+                f"Elapsed time: {elapsed} seconds",
+                f"Finished: {address}"
+            ]))
         else:
-            machines = client.search(args.query, args.active)
-            if len(machines) == 1:
-                machine = machines[0]
+            print(f"There was a problem starting: {machine}")
+    elif result == 1:
+        print("There is a machine that is already active")
+
+
+def _handle_local(args):
+    """Prints the local tun0 IP address"""
+
+    address = Client.get_local_ip()
+    if address is not None:
+        print(address)
+    else:
+        print("Interface tun0 is not up, connect to VPN first")
+
+
+def _handle_query(client, args):
+    """Prints the machines matching the query or ID"""
+
+    import tabulate
+
+    if args.id:
+        machines = [client.client.get_machine(args.id)]
+    else:
+        machines = client.search(args.query, retired=not args.active)
+
+    if machines:
+        headers = ["Difficulty", "Name", "ID"]
+        output = [
+            [machine.difficulty, machine.name, machine.id]
+            for machine in machines
+        ]
+        print(tabulate.tabulate(output, headers=headers, tablefmt="psql"))
+    else:
+        raise Exception(f"No machines found for query: {args.query}")
+
+
+def _handle_start(client, args):
+    """Starts the machine matching the query or ID"""
+
+    if args.id:
+        machine = client.client.get_machine(args.id)
+        _start_and_wait(client, machine)
+    else:
+        active = client.prefetch(retired=not args.active)
+        machines = client.search(args.start, retired=not args.active)
+        if len(machines) == 1:
+            machine = machines[0]
+            _start_and_wait(client, machine, active)
+        elif len(machines) > 1:
+            print("Cannot start multiple machines at once")
+            print("Be more specific with your machine query")
+        else:
+            print(f"Could not find machine to start: {args.start}")
+
+
+def _handle_description(client, args):
+    """Prints the active machine description"""
+
+    import tabulate
+
+    try:
+        machine = client.description()
+    except StopIteration:
+        print("The machine is currently busy with another operation")
+    else:
+        if machine is not None:
+            if args.json is True:
+                json_dict = get_machine_json(machine)
+                print(dumps(json_dict))
+            else:
+                details = machine.machine
                 output = [
-                    ["Difficulty", machine.difficulty],
-                    ["Name", machine.name],
-                    ["ID", machine.id]
+                    ["Difficulty", details.difficulty],
+                    ["Name", details.name],
+                    ["ID", details.id],
+                    ["IP", details.ip]
                 ]
                 print(tabulate.tabulate(output, tablefmt="psql"))
-            elif len(machines) > 1:
-                for machine in machines:
-                    output = []
-                    output.append(["Difficulty", machine.difficulty])
-                    output.append(["Name", machine.name])
-                    output.append(["ID", machine.id])
-                    print(tabulate.tabulate(output, tablefmt="psql"))
-            else:
-                raise Exception(f"No machines found for query: {args.query}")
-    elif args.start:
-        if args.id:
-            machine = client.client.get_machine(args.id)
-            result = client.start(machine)
-            if result == 0:
-                start_time = time.perf_counter()
-                print(f"Started instance: {machine.name}")
-                print("The machine takes time to start up completely")
-                print("Please wait...")
-                total = 300
-                address = None
-                for second in range(total):
-                    time.sleep(1)
-                    try:
-                        address = client.target()
-                    except StopIteration:
-                        pass
-                    else:
-                        if address is not None:
-                            end_time = time.perf_counter()
-                            elapsed = round(end_time - start_time, 2)
-                            print(f"Elapsed time: {elapsed} seconds")
-                            print(f"Finished: {address}")
-                            break
-                else:
-                    print(f"There was a problem starting: {machine}")
-            elif result == 1:
-                print("There is a machine that is already active")
         else:
-            machines = client.search(args.start, args.active)
-            if len(machines) == 1:
-                machine = machines[0]
-                result = client.start(machine)
-                if result == 0:
-                    start_time = time.perf_counter()
-                    print(f"Started instance: {machine.name}")
-                    print("The machine takes time to start up completely")
-                    print("Please wait...")
-                    total = 300
-                    address = None
-                    for second in range(total):
-                        time.sleep(1)
-                        try:
-                            address = client.target()
-                        except StopIteration:
-                            pass
-                        else:
-                            if address is not None:
-                                end_time = time.perf_counter()
-                                elapsed = round(end_time - start_time, 2)
-                                print(f"Elapsed time: {elapsed} seconds")
-                                print(f"Finished: {address}")
-                                break
-                    else:
-                        print(f"There was a problem starting: {machine}")
-                elif result == 1:
-                    print("There is a machine that is already active")
-            elif len(machines) > 1:
-                if args.id:
-                    for machine in machines:
-                        if machine.id  == args.id:
-                            result = client.start(machine)
-                            if result == 0:
-                                start_time = time.perf_counter()
-                                print(f"Started instance: {machine.name}")
-                                print("The machine takes time to start up completely")
-                                print("Please wait...")
-                                total = 300
-                                address = None
-                                for second in range(total):
-                                    time.sleep(1)
-                                    try:
-                                        address = client.target()
-                                    except StopIteration:
-                                        pass
-                                    else:
-                                        if address is not None:
-                                            end_time = time.perf_counter()
-                                            elapsed = round(end_time - start_time, 2)
-                                            print(f"Elapsed time: {elapsed} seconds")
-                                            print(f"Finished: {address}")
-                                            break
-                                else:
-                                    print(f"There was a problem starting: {machine}")
-                            elif result == 1:
-                                print("There is a machine that is already active")
-                else:
-                    print("Cannot start multiple machines at once")
-                    print("Be more specific with your machine query")
-            else:
-                print(f"Could not find machine to start: {args.start}")
-    elif args.description:
-        try:
-            machine = client.description()
-        except StopIteration:
-            print("The machine is currently busy with another operation")
-        else:
-            if machine is not None:
-                if args.json is True:
-                    json_dict = {
-                        "ip": machine.ip,
-                        "server": {
-                            "id": machine.server.id,
-                            "friendly_name": machine.server.friendly_name,
-                            "current_clients": machine.server.current_clients,
-                            "location": machine.server.location
-                        },
-                        "machine": {
-                            "id": machine.machine.id,
-                            "name": machine.machine.name,
-                            "os": machine.machine.os,
-                            "points": machine.machine.points,
-                            "release_date": str(machine.machine.release_date),
-                            "user_owns": machine.machine.user_owns,
-                            "root_owns": machine.machine.root_owns,
-                            "user_owned": machine.machine.user_owned,
-                            "root_owned": machine.machine.root_owned,
-                            "reviewed": machine.machine.reviewed,
-                            "stars": machine.machine.stars,
-                            "avatar": machine.machine.avatar,
-                            "difficulty": machine.machine.difficulty,
-                            "free": machine.machine.free,
-                            "author_ids": machine.machine._author_ids,
-                            "active": machine.machine.active,
-                            "retired": machine.machine.retired,
-                            "user_own_time": str(machine.machine.user_own_time),
-                            "root_own_time": str(machine.machine.root_own_time),
-                            "difficulty_ratings": {
-                                "Cake": machine.machine.difficulty_ratings["counterCake"],
-                                "VeryEasy": machine.machine.difficulty_ratings["counterVeryEasy"],
-                                "Easy": machine.machine.difficulty_ratings["counterEasy"],
-                                "TooEasy": machine.machine.difficulty_ratings["counterTooEasy"],
-                                "Medium": machine.machine.difficulty_ratings["counterMedium"],
-                                "BitHard": machine.machine.difficulty_ratings["counterBitHard"],
-                                "Hard": machine.machine.difficulty_ratings["counterHard"],
-                                "TooHard": machine.machine.difficulty_ratings["counterTooHard"],
-                                "ExHard": machine.machine.difficulty_ratings["counterExHard"],
-                                "BrainFuck": machine.machine.difficulty_ratings["counterBrainFuck"]
-                            },
-                            "user_blood": {
-                                "id": machine.machine.user_blood.id,
-                                "blood": machine.machine.user_blood.blood,
-                                "date": str(machine.machine.user_blood.date),
-                                "name": machine.machine.user_blood.name,
-                                "type": machine.machine.user_blood.type
-                            },
-                            "root_blood": {
-                                "date": str(machine.machine.root_blood.date),
-                                "blood": machine.machine.root_blood.blood,
-                                "id": machine.machine.root_blood.id,
-                                "name": machine.machine.root_blood.name,
-                                "type": machine.machine.root_blood.type
-                            }
-                        }
-                    }
-                    print(json.dumps(json_dict, indent=2))
-                else:
-                    output = [
-                        ["Difficulty", machine.machine.difficulty],
-                        ["Name", machine.machine.name],
-                        ["ID", machine.machine.id],
-                        ["IP", machine.machine.ip]
-                    ]
-                    print(tabulate.tabulate(output, tablefmt="psql"))
-            else:
-                print("No active machine available")
-    elif args.kill:
-        try:
-            machine = client.stop()
-        except StopIteration:
-            print("The machine is currently busy with another operation")
-        else:
-            if machine is not None:
-                start_time = time.perf_counter()
-                print(f"Stopped: {machine}")
-                print("The machine takes time to stop completely")
-                print("Please wait...")
-                total = 60
-                address = None
-                for second in range(total):
-                    time.sleep(1)
-                    address = client.target()
-                    if address is None:
-                        end_time = time.perf_counter()
-                        elapsed = round(end_time - start_time, 2)
-                        print(f"Elapsed time: {elapsed} seconds")
-                        print(f"Finished: {machine} was stopped")
-                        break
-                else:
-                    print(f"There was a problem stopping: {machine}")
+            print("No active machine available")
+
+
+def _handle_kill(client, args):
+    """Stops the active machine"""
+
+    try:
+        machine = client.stop()
+    except StopIteration:
+        print("The machine is currently busy with another operation")
+    else:
+        if machine is not None:
+            start_time = time.monotonic()
+            print("\n".join([
+                f"Stopped: {machine}",
+                "The machine takes time to stop completely",
+                "Please wait..."
+            ]), flush=True)
+            stopped = _wait_for(lambda: client.target() is None, 60)
+            if stopped:
+                end_time = time.monotonic()
+                elapsed = round(end_time - start_time, 2)
+                print("\n".join([
+                    f"Elapsed time: {elapsed} seconds",
+                    f"Finished: {machine} was stopped"
+                ]))
             else:
-                print("No active machine available to stop")
-    elif args.reset:
-        try:
-            machine = client.reset()
-        except StopIteration:
-            print("The machine is currently busy with another operation")
+                print(f"There was a problem stopping: {machine}")
         else:
-            if machine is not None:
-                start_time = time.perf_counter()
-                print(f"Resetting: {machine}")
-                print("The machine takes time to start up completely")
-                print("Please wait...")
-                total = 300
-                address = None
-                for second in range(total):
-                    time.sleep(1)
-                    try:
-                        address = client.target()
-                    except StopIteration:
-                        pass
-                    else:
-                        if address is not None:
-                            end_time = time.perf_counter()
-                            elapsed = round(end_time - start_time, 2)
-                            print(f"Elapsed time: {elapsed} seconds")
-                            print(f"Finished: {address}")
-                            break
-                else:
-                    print(f"There was a problem resetting: {machine}")
-            else:
-                print("No active machine available to reset")
-    elif args.flag:
-        flag_parts = args.flag.split(":")
-        if len(flag_parts) == 2:
-            flag, difficulty = flag_parts
-            try:
-                difficulty = int(difficulty)
-            except ValueError:
-                print("Invalid difficulty argument, must be an integer")
+            print("No active machine available to stop")
+
+
+def _handle_reset(client, args):
+    """Resets the active machine"""
+
+    try:
+        machine = client.reset()
+    except StopIteration:
+        print("The machine is currently busy with another operation")
+    else:
+        if machine is not None:
+            print("\n".join([
+                f"Resetting: {machine}",
+                "The machine takes time to start up completely",
+                "Please wait..."
+            ]), flush=True)
+            address, elapsed = _wait_for_address(client)
+            if address is not None:
+                print("\n".join([
+                    f"Elapsed time: {elapsed} seconds",
+                    f"Finished: {address}"
+                ]))
             else:
-                if difficulty % 10:
-                    print("Difficulty must be a multiple of 10")
-                elif difficulty < 10 or difficulty > 100:
-                    print("Difficulty must be between 10 and 100")
-                else:
-                    result = client.submit(flag, difficulty)
-                    if result is not None:
-                        machine, message = result
-                        print(f"Submitted flag for: {machine}")
-                        print(f"Flag {flag} -> Difficulty {difficulty}")
-                        print(f"Message: {message}")
-                    else:
-                        print("No active machine available to submit flag for")
+                print(f"There was a problem resetting: {machine}")
         else:
-            print(f"Invalid flag format: {args.flag}")
-            print("Correct format is <flag>:<difficulty>")
-    elif args.local:
-        address = client.get_local_ip()
+            print("No active machine available to reset")
+
+
+def _handle_flag(client, args):
+    """Submits a flag to the active machine"""
+
+    flag, difficulty = args.flag
+    result = client.submit(flag, difficulty)
+    if result is not None:
+        machine, message = result
+        print(f"Submitted flag for: {machine}")
+        print(f"Flag {flag} -> Difficulty {difficulty}")
+        print(f"Message: {message}")
+    else:
+        print("No active machine available to submit flag for")
+
+
+def _handle_target(client, args):
+    """Prints the active machine IP address"""
+
+    try:
+        address = client.target()
+    except StopIteration:
+        print("The machine is currently busy with another operation")
+    else:
         if address is not None:
             print(address)
         else:
-            print("Interface tun0 is not up, connect to VPN first")
-    elif args.target:
-        try:
-            address = client.target()
-        except StopIteration:
-            print("The machine is currently busy with another operation")
-        else:
-            if address is not None:
-                print(address)
-            else:
-                print("No active machine available to check target IP for")
+            print("No active machine available to check target IP for")
 
 
-if __name__ == "__main__":
-    import argparse
+def main(args):
+    if args.local:
+        _handle_local(args)
+        return
+
+    if os.geteuid() != 0:
+        print("[!] Must be run as an administrator")
+        sys.exit(1)
+
+    try:
+        client = Client(args.token_path)
+    except TokenNotFound as error:
+        print(f"[-] {error}")
+        sys.exit(1)
+
+    args.handler(client, args)
 
+
+if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "-a", "--api-token-path",
@@ -518,7 +597,7 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "--active",
-        action="store_false",
+        action="store_true",
         help="specify active flag if looking for active machines"
     )
     parser.add_argument(
@@ -531,32 +610,35 @@ if __name__ == "__main__":
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument(
         "-q", "--query",
+        action=Command, handler=_handle_query,
         dest="query", type=str,
         help="specify machine name to query for"
     )
     group.add_argument(
         "-s", "--start",
+        action=Command, handler=_handle_start,
         dest="start", type=str,
         help="specify machine name to start/spawn"
     )
     group.add_argument(
         "-d", "--description",
-        action="store_true",
+        action=Command, handler=_handle_description, nargs=0,
         help="specify description flag to get active machine description"
     )
     group.add_argument(
         "-k", "--kill",
-        action="store_true",
+        action=Command, handler=_handle_kill, nargs=0,
         help="specify kill flag to stop an active machine"
     )
     group.add_argument(
         "-r", "--reset",
-        action="store_true",
+        action=Command, handler=_handle_reset, nargs=0,
         help="specify reset flag to reset an active machine"
     )
     group.add_argument(
         "-f", "--flag",
-        dest="flag", type=str,
+        action=Command, handler=_handle_flag,
+        dest="flag", type=_flag_type,
         help="specify flag to submit flag and difficulty to active machine"
     )
     group.add_argument(
@@ -566,7 +648,7 @@ if __name__ == "__main__":
     )
     group.add_argument(
         "-t", "--target",
-        action="store_true",
+        action=Command, handler=_handle_target, nargs=0,
         help="specify target flag to get the IP address of an active machine"
     )
     args = parser.parse_args()